@@ -1,5 +1,10 @@
 import copy
 import re
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, intern is a builtin
+    pass
 from dynamic_stack_decider.tree import Tree, AbstractTreeElement, DecisionTreeElement, ActionTreeElement, \
     SequenceTreeElement
 
@@ -86,6 +91,8 @@ class DSDParser:
                     if re.search(r'\s*-?->\s*', line_content):
                         # Arrow in line, split in decision result and call
                         result, call = re.split(r'\s*-?->\s*', line_content, 1)
+                        # Interned, so that looking up children by the result received from a remote DSD is faster
+                        result = intern(result)
 
                         if call.startswith('#'):
                             # A subtree is called here.
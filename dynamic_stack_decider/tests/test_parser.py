@@ -1,6 +1,12 @@
 import os
 import unittest
 
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, intern is a builtin
+    pass
+
 from dynamic_stack_decider.parser import DSDParser
 from dynamic_stack_decider.tree import DecisionTreeElement, ActionTreeElement, SequenceTreeElement
 
@@ -95,6 +101,10 @@ class ParserTest(unittest.TestCase):
         self.assertEqual(sub_behavior_1_root_decision.activation_reason, 'SECOND_SUBBEHAVIOR_1')
         self.assertEqual(sub_behavior_2_root_decision.activation_reason, 'SECOND_SUBBEHAVIOR_2')
 
+    def test_interned_results(self):
+        for result in self.tree.root_element.children.keys():
+            self.assertIs(result, intern(result))
+
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,83 @@
+from python_qt_binding.QtGui import QStandardItem
+
+
+# Functions returning the (label, value) pairs of debug_data containers
+_CHILD_ITEMS_BY_TYPE = {
+    list: enumerate,
+    dict: dict.items,
+}
+
+# Types of debug_data which are displayed as text
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+class DebugDataItem(QStandardItem):
+    """
+    A QStandardItem representing a part of an elements debug_data
+    """
+    def __init__(self):
+        super(DebugDataItem, self).__init__()
+        self.setEditable(False)
+
+    def update(self, label, debug_data):
+        """
+        Display label and debug_data in this item.
+        Scalars are appended to the label while containers are displayed as child items.
+        Child items which were already created are updated in place, so that the view keeps their state.
+
+        :type label: str
+        :type debug_data: dict or list or int or float or str or bool
+        """
+        if isinstance(debug_data, _SCALAR_TYPES):
+            text = label + str(debug_data)
+        else:
+            text = label
+        # Compare the text instead of the data, 1, 1.0 and True are equal but displayed differently
+        if self.text() != text:
+            self.setText(text)
+
+        if type(debug_data) in _CHILD_ITEMS_BY_TYPE and debug_data:
+            self.__update_children(debug_data)
+        elif self.rowCount():
+            # Remove the items of the old debug_data
+            self.removeRows(0, self.rowCount())
+
+    def __update_children(self, debug_data):
+        """
+        Reconcile the child items with a debug_data container by index, only changed rows are replaced
+
+        :type debug_data: dict or list
+        """
+        # Dicts which only contain scalars are displayed as a single multi-line item
+        if type(debug_data) is dict and all(isinstance(data, _SCALAR_TYPES) for data in debug_data.values()):
+            text = '\n'.join(str(label) + ": " + str(data) for label, data in debug_data.items())
+            child_item = self.child(0)
+            if self.rowCount() == 1 and not isinstance(child_item, DebugDataItem):
+                if child_item.text() != text:
+                    child_item.setText(text)
+                return
+            if self.rowCount():
+                self.removeRows(0, self.rowCount())
+            child_item = QStandardItem(text)
+            child_item.setEditable(False)
+            self.appendRow(child_item)
+            return
+
+        row_count = self.rowCount()
+        children = list(_CHILD_ITEMS_BY_TYPE[type(debug_data)](debug_data))
+        for row, (label, data) in enumerate(children[:row_count]):
+            child_item = self.child(row)
+            if not isinstance(child_item, DebugDataItem):
+                child_item = DebugDataItem()
+                self.setChild(row, child_item)
+            child_item.update(str(label) + ": ", data)
+
+        if row_count > len(children):
+            self.removeRows(len(children), row_count - len(children))
+        elif row_count < len(children):
+            # Add the new items to the model before filling them,
+            # appendRows does not pass the model on to children of the appended items
+            new_items = [DebugDataItem() for _ in range(len(children) - row_count)]
+            self.appendRows(new_items)
+            for child_item, (label, data) in zip(new_items, children[row_count:]):
+                child_item.update(str(label) + ": ", data)
@@ -1,28 +1,121 @@
+import hashlib
+import itertools
 import json
-import re
-import uuid
+import sys
+import time
+from collections import OrderedDict
 import pydot
 import rospy
 from std_msgs.msg import String
+from python_qt_binding.QtCore import QObject, QRunnable, QThreadPool, Signal
 from python_qt_binding.QtGui import QStandardItemModel, QStandardItem
-from dynamic_stack_decider.abstract_stack_element import AbstractStackElement
 from dynamic_stack_decider.dsd import DSD
 from dynamic_stack_decider.tree import AbstractTreeElement, ActionTreeElement, DecisionTreeElement, SequenceTreeElement
+from .debug_data_item_model import DebugDataItem
+
+try:
+    # orjson is considerably faster when parsing large messages
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Shape of the dot node by type of the tree element
+_SHAPE_BY_TYPE = {
+    ActionTreeElement: 'box',
+    DecisionTreeElement: 'ellipse',
+    SequenceTreeElement: 'box',
+}
 
 
 class ParseException(Exception):
     pass
 
 
+def json_loads(msg):
+    """
+    Parse a JSON message with orjson if it is available and with the json module otherwise
+    :type msg: bytes
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(msg)
+        except orjson.JSONDecodeError:
+            # json.dumps writes NaN and Infinity by default which orjson does not accept
+            pass
+    return json.loads(msg)
+
+
+class DotgraphNotifier(QObject):
+    """
+    Passes dotgraphs built in a worker thread back to the thread the notifier was created in (i.e. the GUI thread)
+    """
+    # Emits the stack signature and the dotgraph built from it, or None if building it failed
+    finished = Signal(tuple, object)
+
+
+class DotgraphJob(QRunnable):
+    """
+    Builds a dotgraph in the QThreadPool and emits it using a DotgraphNotifier
+    """
+    def __init__(self, build, signature, notifier):
+        """
+        :param build: Function returning the dotgraph
+        :param signature: The stack signature the dotgraph is built from
+        :type signature: tuple
+        :type notifier: DotgraphNotifier
+        """
+        super(DotgraphJob, self).__init__()
+        self.build = build
+        self.signature = signature
+        self.notifier = notifier
+
+    def run(self):
+        dot = None
+        try:
+            dot = self.build()
+        except Exception as e:
+            rospy.logerr('Error while building the dotgraph: {}'.format(e))
+        finally:
+            # Always notify, otherwise no further job would be started
+            self.notifier.finished.emit(self.signature, dot)
+
+
 class DsdSlave(DSD):
 
+    # Seconds after which /debug_active is read again for the error dotgraph
+    ERROR_DOTGRAPH_REFRESH_INTERVAL = 1.0
+
+    # Number of parsed messages which are kept to avoid parsing recurring messages again
+    PARSED_MSG_CACHE_SIZE = 8
+
     def __init__(self, debug_topic):
         DSD.__init__(self, None)
 
         self.debug_subscriber = rospy.Subscriber(debug_topic, String, self.subscriber_callback, queue_size=10)
-        self.__cached_msg = None
+        # Only a digest and the length of the last message are kept to detect unchanged messages
+        self.__cached_digest = None
+        self.__cached_msg_len = None
+        # Parsed messages by (digest, length), oldest first
+        self.__parsed_msg_cache = OrderedDict()
+        # Tuple of the /debug_active value and the error dotgraph showing it, as well as the time it was checked
+        self.__cached_error_dotgraph = None
+        self.__cached_error_dotgraph_time = None
+        # Tuple of the stack signature and the dotgraph generated from it
         self.__cached_dotgraph = None
-        self.__cached_item_model = None
+        # Dotgraphs are built in a worker thread, only one job runs at a time
+        self.__dotgraph_job = None
+        self.__dotgraph_notifier = DotgraphNotifier()
+        self.__dotgraph_notifier.finished.connect(self.__dotgraph_finished)
+        # The item model is kept and updated in place, so that the view does not have to be reset
+        self.__item_model = QStandardItemModel()
+        self.__item_model_outdated = False
+        # Names of the dot nodes by id() of their tree element
+        self.__uid_cache = {}
+        # Labels of sequence elements in the item model by id() of their tree element
+        self.__seq_label_cache = {}
+        # Dot node names only have to be unique inside of this DsdSlave's graphs
+        self.__id_counter = itertools.count()
         self.initialized = False
 
     def _init_element(self, element, parameters=None):
@@ -31,6 +124,13 @@ class DsdSlave(DSD):
         """
         return None
 
+    def load_behavior(self, path):
+        DSD.load_behavior(self, path)
+        # The node names and labels belong to the elements of the old tree
+        self.__uid_cache = {}
+        self.__seq_label_cache = {}
+        self.__cached_dotgraph = None
+
     def update(self, reevaluate=True):
         """
         The DSD slave does not execute any code
@@ -40,70 +140,124 @@ class DsdSlave(DSD):
     def close(self):
         self.debug_subscriber.unregister()
 
-    def __parse_remote_data(self, remaining_data, parent_element=None):
+    def __parse_remote_data(self, remaining_data):
         """
-        Recursively parse the remaining part of a remote DSDs state description message
-        :arg parent_element: The Tree element which is the parent of the newly parsed element
-        :type parent_element: AbstractTreeElement
+        Parse a remote DSDs state description message and update the stack from it.
+        Elements which are already on the stack are kept, only the part of the stack which changed is replaced.
         :type remaining_data: dict
         """
         if remaining_data is None:
-            # recursion exit
             return
 
         if remaining_data['type'] == 'abstract':
             raise ParseException('Remote DSD sent an abstract element in its stack')
 
-        if isinstance(parent_element, ActionTreeElement):
-            raise ParseException('The remote DSD sent further elements which seem to be on the stack'
-                                 'but the local DSD tree has already reached an ActionElement')
-
-        if parent_element is None:
-            # If no parent_element was given, then we are processing the root element
-            self.set_start_element(self.tree.root_element)
-            self.tree.root_element.debug_data = remaining_data['debug_data']
-
-            self.__parse_remote_data(remaining_data['next'], self.tree.root_element)
-
-        else:
-            element = parent_element.get_child(remaining_data['activation_reason'])
+        # The first element always is the root element
+        parent_element = self.tree.root_element
+        if not self.stack or self.stack[0][0] is not parent_element:
+            self.set_start_element(parent_element)
+        parent_element.debug_data = remaining_data['debug_data']
+        remaining_data = remaining_data['next']
+        # Number of elements of the stack which are already up to date
+        depth = 1
+
+        while remaining_data is not None:
+            if remaining_data['type'] == 'abstract':
+                raise ParseException('Remote DSD sent an abstract element in its stack')
+
+            if isinstance(parent_element, ActionTreeElement):
+                raise ParseException('The remote DSD sent further elements which seem to be on the stack'
+                                     'but the local DSD tree has already reached an ActionElement')
+
+            # The keys of the children are interned by the parser, so an interned result is found by identity
+            element = parent_element.get_child(sys.intern(remaining_data['activation_reason']))
             element.debug_data = remaining_data['debug_data']
             if remaining_data['type'] == 'sequence':
                 element.current_child = remaining_data['current']
+
+            # Replace the rest of the stack when it diverges from the remote one
+            if depth >= len(self.stack) or self.stack[depth][0] is not element:
+                self.stack = self.stack[0:depth]
                 self.push(element)
-            else:
-                self.push(element)
-                self.__parse_remote_data(remaining_data['next'], element)
+            depth += 1
+
+            if remaining_data['type'] == 'sequence':
+                break
+
+            parent_element = element
+            remaining_data = remaining_data['next']
+
+        # Drop elements which are no longer on the remote stack
+        if len(self.stack) > depth:
+            self.stack = self.stack[0:depth]
+
+    def __parse_msg(self, msg, digest):
+        """
+        Parse a JSON message, reusing the result of a previous identical message if possible
+        :type msg: bytes
+        :type digest: bytes
+        :rtype: dict
+        """
+        key = (digest, len(msg))
+        data = self.__parsed_msg_cache.get(key)
+        if data is None:
+            data = json_loads(msg)
+            self.__parsed_msg_cache[key] = data
+            if len(self.__parsed_msg_cache) > self.PARSED_MSG_CACHE_SIZE:
+                # Evict the oldest entry
+                self.__parsed_msg_cache.popitem(last=False)
+        return data
 
     def subscriber_callback(self, msg):
         # abort if the dsd is not fully loaded yet
         if not self.initialized:
             return
 
-        msg = msg.data
+        msg = msg.data.encode()
+        digest = hashlib.blake2b(msg, digest_size=16).digest()
 
         # abort if nothing changed
-        if msg == self.__cached_msg:
+        if digest == self.__cached_digest and len(msg) == self.__cached_msg_len:
             return
-        self.__cached_dotgraph = None
-        self.__cached_item_model = None
 
         # parse the remaining stack (without root element)
-        self.__parse_remote_data(json.loads(msg))
+        self.__parse_remote_data(self.__parse_msg(msg, digest))
+        # mark the item model outdated only after parsing, so it is not built from a partially parsed stack
+        self.__item_model_outdated = True
 
-        # save the message so we know not to reprocess it again
-        self.__cached_msg = msg
+        # save the message digest so we know not to reprocess it again
+        self.__cached_digest = digest
+        self.__cached_msg_len = len(msg)
 
-    @staticmethod
-    def __error_dotgraph():
-        dot = pydot.Dot(graph_type='digraph')
+    def __next_uid(self):
+        """
+        Generate a new unique dot node name
+        :rtype: str
+        """
+        return 'n{}'.format(next(self.__id_counter))
+
+    def __error_dotgraph(self):
+        """
+        Get the dotgraph which is shown while no data was received.
+        It is only regenerated every ERROR_DOTGRAPH_REFRESH_INTERVAL seconds to avoid querying the parameter server
+        on every redraw.
+        """
+        now = time.time()
+        if self.__cached_error_dotgraph is not None and \
+                now - self.__cached_error_dotgraph_time < self.ERROR_DOTGRAPH_REFRESH_INTERVAL:
+            return self.__cached_error_dotgraph[1]
 
         param_debug_active = rospy.get_param("/debug_active", False)
+        self.__cached_error_dotgraph_time = now
+        if self.__cached_error_dotgraph is not None and param_debug_active == self.__cached_error_dotgraph[0]:
+            return self.__cached_error_dotgraph[1]
 
-        uid1 = str(uuid.uuid4())
+        dot = pydot.Dot(graph_type='digraph')
+
+        uid1 = self.__next_uid()
         dot.add_node(pydot.Node(uid1, label="I have not received anything from the dsd yet"))
 
-        uid2 = str(uuid.uuid4())
+        uid2 = self.__next_uid()
         dot.add_node(pydot.Node(uid2, label="Please make sure that\n"
                                             "- The appropriate dsd is started\n"
                                             "- You are connected to the same roscore\n"
@@ -111,19 +265,20 @@ class DsdSlave(DSD):
 
         dot.add_edge(pydot.Edge(uid1, uid2))
 
+        self.__cached_error_dotgraph = (param_debug_active, dot)
         return dot
 
     @staticmethod
-    def __empty_item_model():
-        return QStandardItemModel()
-
-    @staticmethod
-    def __dot_node_from_stack_element(element, active):
+    def __dot_node_from_stack_element(uid, element, active, current_child=None):
         """
+        :param uid: The name of the dot node
+        :type uid: str
         :param element: The element to generate the dot node from
         :type element: AbstractTreeElement
         :param active: Whether the node is currently active or not
         :type active: bool
+        :param current_child: The name of the current action if element is a sequence on the stack
+        :type current_child: str
         :return: The corresponding dot node
         :rtype: pydot.Node
         """
@@ -136,15 +291,15 @@ class DsdSlave(DSD):
             pstr = ' (' + pstr + ')'
             return pstr
 
-        if isinstance(element, SequenceTreeElement):
-            shape = 'box'
+        shape = _SHAPE_BY_TYPE.get(type(element), 'box')
 
+        if isinstance(element, SequenceTreeElement):
             label = ['Sequence:']
             for e in element.action_elements:
                 # Spaces for indentation
                 action_label = '  '
                 # Mark current element (if this sequence is on the stack)
-                if active and e.name == element.current_child:
+                if active and e.name == current_child:
                     action_label += '--> '
                 action_label += e.name
                 if e.parameters:
@@ -153,137 +308,183 @@ class DsdSlave(DSD):
             label = '\n'.join(label)
 
         elif isinstance(element, DecisionTreeElement):
-            shape = 'ellipse'
             label = element.name
 
         else:
-            shape = 'box'
             label = element.name
             if element.parameters:
                 label += param_string(element.parameters)
 
         # Create node in graph
-        uid = str(uuid.uuid4())
         if active:
             return pydot.Node(uid, label=label, shape=shape)
         else:
             return pydot.Node(uid, label=label, shape=shape, color='lightgray')
 
-    def __stack_to_dotgraph(self, stack, dot):
+    def __element_uid(self, element):
         """
-        Recursively modify dot to include every element of the stack
+        Get the dot node name of a tree element. It is only generated once per element.
+        :type element: AbstractTreeElement
+        :rtype: str
         """
-        element, _ = stack[0]
-
-        node = DsdSlave.__dot_node_from_stack_element(element, True)
-
-        # Determine correct shape
-        dot.add_node(node)
+        uid = self.__uid_cache.get(id(element))
+        if uid is None:
+            uid = self.__next_uid()
+            self.__uid_cache[id(element)] = uid
+        return uid
 
-        # Append all direct children to graph
-        # Also append all children which are on the stack to the graph
-        if isinstance(element, DecisionTreeElement):
-            for activating_result, child in element.children.items():
+    def __stack_to_dotgraph(self, stack, dot):
+        """
+        Modify dot to include every element of the stack as well as the direct children of those elements
+        :param stack: A snapshot of the stack as returned by __stack_snapshot
+        """
+        for i, (element, current_child) in enumerate(stack):
+            uid = self.__element_uid(element)
+            dot.add_node(DsdSlave.__dot_node_from_stack_element(uid, element, True, current_child))
+
+            # Append all direct children to graph
+            # The child which is on the stack as well is added in the next iteration
+            if isinstance(element, DecisionTreeElement):
+                next_element = stack[i + 1][0] if i + 1 < len(stack) else None
+                for activating_result, child in element.children.items():
+                    if next_element is not None and activating_result == next_element.activation_reason:
+                        child_uid = self.__element_uid(next_element)
+
+                    # Draw this child as shape because we want to show direct children of elements
+                    else:
+                        child_uid = self.__element_uid(child)
+                        dot.add_node(DsdSlave.__dot_node_from_stack_element(child_uid, child, False))
+
+                    # Connect the child to the parent element
+                    dot.add_edge(pydot.Edge(uid, child_uid, label=activating_result))
 
-                # Since this child is on the stack as well, it should be represented completely
-                if len(stack) > 1 and activating_result == stack[1][0].activation_reason:
-                    dot, child_uid = self.__stack_to_dotgraph(stack[1:], dot)
+        return dot
 
-                # Draw this child as shape because we want to show direct children of elements
-                else:
-                    child_node = DsdSlave.__dot_node_from_stack_element(child, False)
-                    child_uid = child_node.get_name()
-                    dot.add_node(child_node)
+    def __sequence_label(self, element):
+        """
+        Get the label of a sequence element in the item model. It is only generated once per element.
+        :type element: SequenceTreeElement
+        :rtype: str
+        """
+        label = self.__seq_label_cache.get(id(element))
+        if label is None:
+            label = 'Sequence: ' + ', '.join(str(e) for e in element.action_elements)
+            self.__seq_label_cache[id(element)] = label
+        return label
 
-                # Connect the child to the parent element
-                edge = pydot.Edge(node.get_name(), child_uid, label=activating_result)
-                dot.add_edge(edge)
+    def __stack_snapshot(self):
+        """
+        Copy everything of the current stack which influences its dotgraph, i.e. except the debug_data.
+        The ROS thread keeps changing the stack, so the dotgraph has to be built from this copy only.
+        :return: The elements of the stack and the current child of sequence elements
+        :rtype: list
+        """
+        return [(elem, getattr(elem, 'current_child', None)) for elem, _ in self.stack]
 
-        return dot, node.get_name()
+    @staticmethod
+    def __stack_signature(stack):
+        """
+        :param stack: A snapshot of the stack as returned by __stack_snapshot
+        :rtype: tuple
+        """
+        return tuple((id(elem), elem.activation_reason, current_child) for elem, current_child in stack)
 
-    def __append_element_to_item(self, parent_item, debug_data):
+    def __build_dotgraph(self, stack):
         """
-        Append an elements debug_data to a QStandardItem.
+        :param stack: A snapshot of the stack as returned by __stack_snapshot
+        :rtype: pydot.Dot
+        """
+        dot = pydot.Dot(graph_type='digraph')
+        return self.__stack_to_dotgraph(stack, dot)
 
-        :type parent_item: python_qt_binding.QtGui.QStandardItem
-        :type debug_data: dict or list or int or float or str or bool
-        :rtype: python_qt_binding.QtGui.QStandardItem
+    def __dotgraph_finished(self, signature, dot):
         """
-        if type(debug_data) is list:
-            for i, data in enumerate(debug_data):
-                child_item = QStandardItem()
-                child_item.setText(str(i) + ": ")
-                child_item.setEditable(False)
-                self.__append_element_to_item(child_item, data)
-                parent_item.appendRow(child_item)
-        elif type(debug_data) is dict:
-            for label, data in debug_data.items():
-                child_item = QStandardItem()
-                child_item.setText(str(label) + ": ")
-                child_item.setEditable(False)
-                self.__append_element_to_item(child_item, data)
-                parent_item.appendRow(child_item)
-        elif type(debug_data) is str or type(debug_data) is int \
-                or type(debug_data) is float or type(debug_data) is bool\
-                or type(debug_data) is unicode:
-            parent_item.setText(parent_item.text() + str(debug_data))
+        Called in the GUI thread when a DotgraphJob is done
+        """
+        self.__dotgraph_job = None
+        # Keep showing the previous dotgraph if the job failed
+        if dot is not None:
+            self.__cached_dotgraph = (signature, dot)
 
     def to_dotgraph(self):
         """
-        Represent the current stack as dotgraph
+        Represent the current stack as dotgraph.
+        When the stack changed, the new dotgraph is built in the background and the previous one is returned
+        until it is done.
         """
-        # Return cached result if available
-        if self.__cached_dotgraph is not None:
-            return self.__cached_dotgraph
-
         # Return special error graph which shows error information when no data was received
-        if self.__cached_msg is None:
+        if self.__cached_digest is None:
             return self.__error_dotgraph()
 
-        dot = pydot.Dot(graph_type='digraph')
-        dot, uid = self.__stack_to_dotgraph(self.stack, dot)
+        # Return cached result if the stack did not change
+        stack = self.__stack_snapshot()
+        signature = self.__stack_signature(stack)
+        if self.__cached_dotgraph is not None and self.__cached_dotgraph[0] == signature:
+            return self.__cached_dotgraph[1]
 
-        self.__cached_dotgraph = dot
-        return dot
+        # Build the first dotgraph directly because there is nothing which could be shown instead
+        if self.__cached_dotgraph is None:
+            self.__cached_dotgraph = (signature, self.__build_dotgraph(stack))
+            return self.__cached_dotgraph[1]
+
+        if self.__dotgraph_job is None:
+            self.__dotgraph_job = DotgraphJob(lambda: self.__build_dotgraph(stack), signature,
+                                              self.__dotgraph_notifier)
+            QThreadPool.globalInstance().start(self.__dotgraph_job)
+
+        return self.__cached_dotgraph[1]
 
     def to_QItemModel(self):
         """
-        Represent the DSDs debug data as QITemModel
+        Represent the DSDs debug data as QITemModel.
+        The same model is returned on every call and updated in place, only rows which changed are replaced.
         """
-        # Return cached result if available
-        if self.__cached_item_model is not None:
-            return self.__cached_item_model
-
-        # Return empty model when no dsd data was received yet
-        if self.__cached_msg is None:
-            return self.__empty_item_model()
-
-        # Construct a new item-model
-        model = QStandardItemModel()
-        for i in range(len(self.stack)):
-            elem, _ = self.stack[i]
-            elem_item = QStandardItem()
-            elem_item.setEditable(False)
-
+        # Return the model as it is when no dsd data was received yet or nothing changed
+        if self.__cached_digest is None or not self.__item_model_outdated:
+            return self.__item_model
+
+        root_item = self.__item_model.invisibleRootItem()
+        # Labels and debug_data of the element items, None for spacers
+        rows = []
+        last_index = len(self.stack) - 1
+        for i, (elem, _) in enumerate(self.stack):
             if isinstance(elem, SequenceTreeElement):
-                elem_item.setText('Sequence: ' + ', '.join(str(e) for e in elem.action_elements))
+                rows.append((self.__sequence_label(elem), elem.debug_data))
                 sequence = True
             else:
-                elem_item.setText(str(elem))
+                rows.append((str(elem), elem.debug_data))
                 sequence = False
 
-            self.__append_element_to_item(elem_item, elem.debug_data)
-
-            model.invisibleRootItem().appendRow(elem_item)
-
             # Add a spacer if this is not the last item
-            if elem != self.stack[-1][0]:
-                spacer = QStandardItem()
-                spacer.setEditable(False)
-                model.invisibleRootItem().appendRow(spacer)
+            if i != last_index:
+                rows.append(None)
 
             if sequence:
                 break
 
-        self.__cached_item_model = model
-        return self.__cached_item_model
+        row_count = root_item.rowCount()
+        if row_count > len(rows):
+            # Remove the rows of elements which are no longer on the stack
+            root_item.removeRows(len(rows), row_count - len(rows))
+        elif row_count < len(rows):
+            # Add all new rows at once so that the model is only changed once.
+            # They are filled afterwards, appendRows does not pass the model on to children of the appended items
+            root_item.appendRows([QStandardItem() for _ in range(len(rows) - row_count)])
+
+        for row, data in enumerate(rows):
+            item = root_item.child(row)
+            if data is None:
+                # Spacer
+                if type(item) is not QStandardItem:
+                    item = QStandardItem()
+                    root_item.setChild(row, item)
+                item.setEditable(False)
+            else:
+                # Reuse the existing element item, so that the view keeps its expansion state
+                if not isinstance(item, DebugDataItem):
+                    item = DebugDataItem()
+                    root_item.setChild(row, item)
+                item.update(*data)
+
+        self.__item_model_outdated = False
+        return self.__item_model
@@ -222,12 +222,28 @@ class DsdVizPlugin(Plugin):
         """Render debug data in the tree view on the right side of the scene"""
 
         # Only redraw when the item-model differs from the previous one
+        # The model of a DsdSlave is updated in place and always stays the same
         if self._prev_QItemModel == qitem_model:
             return
         else:
+            if self._prev_QItemModel is not None:
+                self._prev_QItemModel.rowsInserted.disconnect(self._expand_inserted_rows)
             self._prev_QItemModel = qitem_model
             self._widget.stack_prop_tree_view.setModel(qitem_model)
             self._widget.stack_prop_tree_view.expandAll()
+            qitem_model.rowsInserted.connect(self._expand_inserted_rows)
+
+    def _expand_inserted_rows(self, parent, first, last):
+        """
+        Expand rows which were added to the currently rendered item-model, like expandAll() did for the existing ones.
+        Rows which were collapsed by the user are kept collapsed because the model is updated in place.
+        Items which get their first children, e.g. because their debug_data changed from a scalar to a container,
+        are expanded as well, since expandAll() does not expand items without children.
+        """
+        if parent.isValid() and first == 0 and self._prev_QItemModel.rowCount(parent) == last + 1:
+            self._widget.stack_prop_tree_view.expand(parent)
+        for row in range(first, last + 1):
+            self._widget.stack_prop_tree_view.expand(self._prev_QItemModel.index(row, 0, parent))
 
     def set_dsd(self, name):
         """